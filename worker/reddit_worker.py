@@ -16,17 +16,55 @@ Env variables required:
   - REDDIT_POLL_SECONDS (optional, default 300)
   - REDDIT_MAX_POSTS (optional)
   - REDDIT_MAX_COMMENTS (optional)
+  - REDDIT_CONCURRENCY (optional, default 4)
+  - REDDIT_SENTI_PROCS (optional, default cpu count)
+  - REDDIT_SENTI_CACHE (optional, default 20000) sentiment scores cached on the writer side
+  - REDDIT_SENTI_PROC_CACHE (optional, default 8192) sentiment scores cached per sentiment process
+  - REDDIT_DB_WRITERS (optional, default 2)
+  - REDDIT_WRITE_FLUSH_ROWS (optional, default 200) rows a db writer buffers before flushing
+  - REDDIT_INSERT_BATCH_SIZE (optional, default 500) rows per COPY / RPC / upsert call
+  - REDDIT_SEEN_CACHE_SIZE (optional, default 50000) stored reddit_ids remembered to skip re-writes
+  - DATABASE_URL (optional) direct Postgres DSN; enables LISTEN/NOTIFY wakeups on new jobs
+    and COPY-based bulk writes into reddit_comments
+  - REDDIT_SAFETY_POLL_SECONDS (optional, default 1800) catch-up poll interval while listening
 """
 
 import os
+import io
+import csv
+import contextlib
+import json
+import importlib.util
+import functools
+import itertools
 import time
 import logging
 import random
+import re
+import queue
+import select
+import signal
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, fields
 from datetime import datetime, timezone
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Set, Tuple
 
+import httpx
 import praw
-from supabase import create_client, Client
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.pool import ThreadedConnectionPool
+import prawcore
+from praw.models import MoreComments
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
+from supabase import ClientOptions, create_client, Client
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
 # Logging
@@ -40,10 +78,24 @@ RID = os.getenv("REDDIT_CLIENT_ID")
 RSEC = os.getenv("REDDIT_CLIENT_SECRET")
 UA = os.getenv("REDDIT_USER_AGENT", "CampusEventsApp/0.1")
 POLL_SECONDS = int(os.getenv("REDDIT_POLL_SECONDS", "300"))
+DB_URL = os.getenv("DATABASE_URL")
+SAFETY_POLL_SECONDS = int(os.getenv("REDDIT_SAFETY_POLL_SECONDS", "1800"))
+JOBS_CHANNEL = "reddit_jobs_new"  # pg_notify channel fired by the reddit_jobs insert trigger
+RPC_NOT_FOUND = "PGRST202"  # PostgREST error code for a SQL function that isn't deployed
 MAX_POSTS_PER_SUB = int(os.getenv("REDDIT_MAX_POSTS", "20"))
 MAX_COMMENTS_PER_POST = int(os.getenv("REDDIT_MAX_COMMENTS", "50"))
 JOB_BATCH_SIZE = int(os.getenv("REDDIT_JOB_BATCH_SIZE", "5"))  # how many jobs to claim at once
 MAX_ATTEMPTS = int(os.getenv("REDDIT_JOB_MAX_ATTEMPTS", "5"))
+REDDIT_CONCURRENCY = int(os.getenv("REDDIT_CONCURRENCY", "4"))  # max in-flight Reddit requests
+INSERT_BATCH_SIZE = int(os.getenv("REDDIT_INSERT_BATCH_SIZE", "500"))  # rows per upsert call
+SEEN_CACHE_SIZE = int(os.getenv("REDDIT_SEEN_CACHE_SIZE", "50000"))  # reddit_ids remembered across cycles
+SENTI_CACHE_SIZE = int(os.getenv("REDDIT_SENTI_CACHE", "20000"))  # scored texts remembered by the writers
+SENTI_PROC_CACHE_SIZE = int(os.getenv("REDDIT_SENTI_PROC_CACHE", "8192"))  # ...and inside each sentiment process
+SENTI_MAX_CHARS = 2000  # texts are scored (and cached) on at most this many leading chars
+SENTI_PROCS = int(os.getenv("REDDIT_SENTI_PROCS", str(os.cpu_count() or 1)))  # sentiment worker processes
+DB_WRITERS = int(os.getenv("REDDIT_DB_WRITERS", "2"))  # threads draining the write queue
+WRITE_FLUSH_ROWS = int(os.getenv("REDDIT_WRITE_FLUSH_ROWS", "200"))  # a writer flushes once it holds this many rows...
+WRITE_FLUSH_SECONDS = 1.0  # ...or once its oldest buffered row is this old
 
 if not SB_URL or not SB_KEY:
     logger.error("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY are required")
@@ -53,17 +105,265 @@ if not RID or not RSEC:
     raise SystemExit(1)
 
 # --- Clients ---
-sb: Client = create_client(SB_URL, SB_KEY)
-reddit = praw.Reddit(client_id=RID, client_secret=RSEC, user_agent=UA)
+# Job threads and db writers all share sb's PostgREST client. Size its keep-alive pool for that
+# many concurrent callers so batches reuse warm TLS connections, and speak HTTP/2 when h2 is
+# installed so they multiplex over one.
+sb: Client = create_client(
+    SB_URL,
+    SB_KEY,
+    options=ClientOptions(
+        httpx_client=httpx.Client(
+            timeout=30.0,
+            http2=importlib.util.find_spec("h2") is not None,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+        ),
+        postgrest_client_timeout=30,
+    ),
+)
+
+
+def _new_reddit_session() -> requests.Session:
+    # keep-alive session so a thread reuses its TLS connection to oauth.reddit.com. 429 is left
+    # out of the retry list on purpose: it is surfaced to note_rate_limit rather than slept on here.
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=2,  # oauth.reddit.com + www.reddit.com (token endpoint)
+        pool_maxsize=1,  # a thread only ever has one request in flight
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504]),
+    ))
+    return session
+
+
+# PRAW and its requests.Session aren't thread-safe, so every worker thread gets its own client.
+# The thread pools below are long-lived, so each client (and its OAuth token) is built once.
+_thread_local = threading.local()
+
+
+def reddit_client() -> praw.Reddit:
+    client = getattr(_thread_local, "reddit", None)
+    if client is None:
+        # ratelimit_seconds=0: never sleep inside PRAW; 429s are surfaced and handled by the loop instead.
+        # check_for_updates=False: skip PRAW's PyPI version check, which would otherwise run per thread.
+        # timeout=30: multi-reddit searches ask for up to 100 results in one listing and can outlast
+        # PRAW's 16s default, which would fail the search and push the job back onto the queue
+        client = praw.Reddit(
+            client_id=RID,
+            client_secret=RSEC,
+            user_agent=UA,
+            ratelimit_seconds=0,
+            check_for_updates=False,
+            timeout=30,
+            requestor_kwargs={"session": _new_reddit_session()},
+        )
+        _thread_local.reddit = client
+    return client
+
+
 analyzer = SentimentIntensityAnalyzer()
 
+# Reddit calls are fanned out over threads; this caps how many hit the API at once
+# (reddit_call below also spaces them out to stay inside the OAuth quota).
+reddit_slots = threading.Semaphore(REDDIT_CONCURRENCY)
+
+# long-lived pools: one for claimed jobs, one for per-post / per-subreddit Reddit calls
+job_pool = ThreadPoolExecutor(max_workers=JOB_BATCH_SIZE, thread_name_prefix="job")
+reddit_pool = ThreadPoolExecutor(max_workers=REDDIT_CONCURRENCY, thread_name_prefix="reddit")
+
+# wall-clock time until which Reddit told us to back off (from a 429's Retry-After)
+rate_limited_until = 0.0
+
+
+class RateLimited(Exception):
+    pass
+
+
+def note_rate_limit(e: prawcore.exceptions.TooManyRequests) -> None:
+    global rate_limited_until
+    try:
+        wait = int(e.response.headers.get("Retry-After", 60))
+    except (AttributeError, TypeError, ValueError):
+        wait = 60
+    rate_limited_until = max(rate_limited_until, time.time() + wait)
+    logger.warning("reddit rate limit hit - backing off for %s secs", wait)
 
-def senti(text: Optional[str]) -> float:
+
+# spacing between Reddit requests across all threads: starts at 60/min and is retuned after every
+# response from PRAW's view of the X-Ratelimit-* headers, so the quota is spread over its window
+# instead of being burnt through and answered with a 429
+_pace_lock = threading.Lock()
+_next_call_at = 0.0  # monotonic time the next request may start
+_call_interval = 1.0
+# Reddit counts requests over fixed 10-minute windows aligned to the clock
+RATE_WINDOW = 600.0
+
+
+def _retune_pace(limits: Dict[str, Any]) -> None:
+    global _call_interval
+    remaining = limits.get("remaining")
+    if remaining is None:  # no response seen yet
+        return
+    now = time.time()
+    # PRAW 7 reports when the window resets; PRAW 8 only has used/remaining, so fall back to
+    # the end of the current window
+    reset = limits.get("reset_timestamp") or (now // RATE_WINDOW + 1) * RATE_WINDOW
+    with _pace_lock:
+        _call_interval = max(0.0, reset - now) / max(remaining, 1.0)
+
+
+@contextlib.contextmanager
+def reddit_call():
+    # one in-flight slot plus one spacing token per Reddit request. Fails fast while a 429
+    # back-off is in effect, so the rest of a job's requests don't run into it one by one.
+    global _next_call_at
+    with reddit_slots:
+        with _pace_lock:
+            now = time.monotonic()
+            wait = _next_call_at - now
+            _next_call_at = max(now, _next_call_at) + _call_interval
+        if wait > 0:
+            time.sleep(wait)
+        if time.time() < rate_limited_until:
+            raise RateLimited("reddit rate limit in effect")
+        try:
+            yield
+        finally:
+            _retune_pace(reddit_client().auth.limits)
+
+
+# runs of 4+ identical symbols (emoji spam, "!!!!!!", ":::::"): VADER's emoticon handling goes
+# quadratic on these. Three copies are kept because VADER reads "!!!"-style runs as emphasis.
+_EMOJI_RUN = re.compile(r"([^\w\s])\1{3,}")
+# same for repeated ASCII emoticons (":) :) :) :) :)")
+_EMOTICON_RUN = re.compile(r"([:;=xX][-o*']?[)(\[\]|\\/pPdDoO3])(?:\s*\1){3,}")
+
+
+_URL = re.compile(r"https?://\S+")
+
+
+def senti_key(text: Optional[str]) -> str:
+    # links carry no sentiment; dropping them (and outer whitespace) also raises the cache hit rate.
+    # Capped at what actually gets scored: VADER can blow up on huge emoji-heavy bodies and the
+    # first SENTI_MAX_CHARS carry the tone, so a 40k-char selftext never becomes a cache key.
+    # (the slice before the regex keeps a multi-MB paste from being scanned in full)
     if not text:
+        return ""
+    return _URL.sub("", text[:SENTI_MAX_CHARS * 2]).strip()[:SENTI_MAX_CHARS]
+
+
+@functools.lru_cache(maxsize=SENTI_PROC_CACHE_SIZE)
+def _senti_cached(text: str) -> float:
+    # cached on the normalized text: crossposted titles, quotes and bot comments repeat a lot
+    # VADER drops 1-char tokens, so a lone ASCII char is always neutral (a lone emoji is not)
+    if len(text) < 2 and text.isascii():
         return 0.0
+    text = _EMOJI_RUN.sub(r"\1\1\1", text)
+    text = _EMOTICON_RUN.sub(r"\1 \1 \1", text)
+    if not text.isascii():
+        # fold fullwidth / styled letters ("ｇｏｏｄ", "𝐠𝐨𝐨𝐝") onto the ASCII the lexicon is keyed on
+        text = unicodedata.normalize("NFKC", text)
+        # mostly-emoji / non-Latin text is where VADER's per-character emoji lookups get slow
+        if sum(not c.isascii() for c in text) > 200:
+            text = text[:500]
     return float(analyzer.polarity_scores(text).get("compound", 0.0))
 
 
+def _init_senti_process(lexicon: Dict[str, float], emojis: Dict[str, str]) -> None:
+    global analyzer
+    if analyzer.lexicon is lexicon:
+        # forked: the parent's tables are already shared copy-on-write
+        return
+    # otherwise reuse the parsed tables instead of re-reading the lexicon files
+    analyzer = SentimentIntensityAnalyzer.__new__(SentimentIntensityAnalyzer)
+    analyzer.lexicon = lexicon
+    analyzer.emojis = emojis
+
+
+def score_text(text: str) -> float:
+    # texts sent to the pool are already normalized by senti_batch
+    return _senti_cached(text)
+
+
+# VADER is pure Python and holds the GIL, so score batches on separate processes.
+# Workers are forked on first use; main_loop warms the pool before starting any threads.
+senti_pool = ProcessPoolExecutor(
+    max_workers=SENTI_PROCS,
+    initializer=_init_senti_process,
+    initargs=(analyzer.lexicon, analyzer.emojis),
+)
+
+
+# scores already computed by the pool, kept on the writer side: each pool process has its own
+# lru_cache, so a repeated text only hits if it happens to land on the same process again.
+# Keys are senti_key() output, so each entry holds at most SENTI_MAX_CHARS chars.
+_scores: "OrderedDict[str, float]" = OrderedDict()
+_scores_lock = threading.Lock()
+
+
+def senti_batch(texts: List[str]) -> List[float]:
+    """
+    Score many texts at once: each distinct text is scored a single time, spread over the
+    sentiment pool, and the scores are fanned back out in input order.
+    """
+    # normalize first, so texts that only differ by links/whitespace are scored once, and
+    # empty ones (no body, link-only comments) never reach the pool
+    texts = [senti_key(t) for t in texts]
+    by_text: Dict[str, float] = {"": 0.0}
+    with _scores_lock:
+        for t in texts:
+            if t in _scores:
+                _scores.move_to_end(t)
+                by_text[t] = _scores[t]
+    unique = [t for t in dict.fromkeys(texts) if t not in by_text]
+    if unique:
+        # split the batch so every sentiment process gets a share (writer batches are only a few
+        # hundred rows, so a fixed chunk of 32 would leave cores idle), capped to keep IPC overhead low
+        chunksize = max(1, min(32, -(-len(unique) // SENTI_PROCS)))
+        try:
+            scores = list(senti_pool.map(score_text, unique, chunksize=chunksize))
+        except Exception as e:
+            logger.warning("sentiment pool failed, scoring inline: %s", e)
+            scores = [_senti_cached(t) for t in unique]
+        fresh = dict(zip(unique, map(float, scores)))
+        by_text.update(fresh)
+        with _scores_lock:
+            _scores.update(fresh)
+            while len(_scores) > SENTI_CACHE_SIZE:
+                _scores.popitem(last=False)
+    return [by_text[t] for t in texts]
+
+
+@dataclass(slots=True)
+class RedditRow:
+    """One post or comment bound for reddit_comments; fields match the table's columns."""
+    event_id: str
+    reddit_id: Optional[str]
+    subreddit: Optional[str]
+    type: str
+    title: Optional[str]
+    body: Optional[str]
+    author: Optional[str]
+    sentiment: Optional[float]
+    created_utc: str
+    payload: Dict[str, Any]
+
+
+def _sentiment_text(row: RedditRow) -> str:
+    body = row.body or ""
+    if row.type != "post":
+        return body
+    # a real selftext dominates the compound score anyway, so score it alone instead of
+    # re-tokenizing title + body; link/short posts fall back to the title, which is also
+    # shared (and so cached) across crossposts
+    return body if len(body) >= 20 else (row.title or "")
+
+
+def score_rows(rows: List[RedditRow]) -> None:
+    """Fill in the sentiment of built rows: selftext (or title for link posts) for posts, body for comments."""
+    texts = [_sentiment_text(r) for r in rows]
+    for row, score in zip(rows, senti_batch(texts)):
+        row.sentiment = score
+
+
 # Category -> subreddit mapping (expand as needed)
 CATEGORY_SUBREDDITS = {
     "crypto": ["CryptoCurrency", "Bitcoin", "CryptoMarkets"],
@@ -80,6 +380,19 @@ CATEGORY_SUBREDDITS = {
     "workshop": ["learnprogramming", "programming"],
     "cultural": ["culture", "AskReddit"],
 }
+# normalize keys the same way tags are normalized, and freeze the values, once at load
+CATEGORY_SUBREDDITS = {k.lower().replace(" ", "_"): tuple(v) for k, v in CATEGORY_SUBREDDITS.items()}
+
+
+@functools.lru_cache(maxsize=4096)
+def _iso(ts: int) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(ts))
+
+
+def to_iso(ts: Optional[float]) -> str:
+    # reddit timestamps are whole UTC seconds; format them without building a datetime. Rows
+    # missing one get "now", also to the second, so a burst of them shares one cached string.
+    return _iso(int(float(ts)) if ts else int(time.time()))
 
 
 def normalize_event_row(ev: Dict[str, Any]) -> Dict[str, Any]:
@@ -94,46 +407,504 @@ def normalize_event_row(ev: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
+# title tokenizer: alphanumeric runs of 3+ chars, so punctuation ("event!") never reaches the query
+_TOK = re.compile(r"[a-z0-9]{3,}")
+
+
+def _category_keys(ev: Dict[str, Any]) -> Iterable[str]:
+    # normalized tags, then title words and adjacent word pairs ("crypto currency" -> crypto_currency)
+    words = _TOK.findall((ev.get("title") or "").lower())
+    return itertools.chain(
+        (str(tag).strip().lower().replace(" ", "_") for tag in (ev.get("tags") or [])),
+        words,
+        map("_".join, zip(words, words[1:])),
+    )
+
+
+# a valid subreddit name, optionally written as "r/name" or a /r/name path
+_SUBREDDIT_NAME = re.compile(r"^(?:/?r/)?([A-Za-z0-9][A-Za-z0-9_]{1,20})/?$")
+
+
 def build_subreddit_list(ev: Dict[str, Any]) -> List[str]:
-    explicit = [s.strip() for s in (ev.get("subreddits") or []) if s and str(s).strip()]
+    # user-entered names: drop the r/ prefix and anything that can't be a subreddit, which would
+    # otherwise fail the whole multi-reddit search and force the one-search-per-sub fallback
+    explicit = []
+    for s in ev.get("subreddits") or []:
+        m = _SUBREDDIT_NAME.match(str(s or "").strip())
+        if m:
+            explicit.append(m.group(1))
+        elif s:
+            logger.debug("ignoring invalid subreddit name %r for event %s", s, ev.get("id"))
     if explicit:
         return list(dict.fromkeys(explicit))
-    subs: List[str] = []
-    for tag in (ev.get("tags") or []):
-        key = str(tag).strip().lower().replace(" ", "_")
-        mapped = CATEGORY_SUBREDDITS.get(key)
-        if mapped:
-            subs.extend(mapped)
-    if not subs:
-        subs = ["technology", "news"]
-    return list(dict.fromkeys([s for s in subs if s]))
-
-
-def event_already_processed(event_id: str) -> bool:
+    # each key is one dict probe, so the title costs a single tokenize pass; the mapped tuples
+    # are deduped straight into the result without an intermediate list
+    subs = list(dict.fromkeys(itertools.chain.from_iterable(
+        CATEGORY_SUBREDDITS.get(key, ()) for key in _category_keys(ev)
+    )))
+    return subs or ["technology", "news"]
+
+
+_STOPWORDS = frozenset({
+    "the", "and", "for", "with", "from", "this", "that", "are", "was", "our", "your",
+    "you", "all", "its", "into", "about", "will", "day", "event", "events", "vit",
+})
+
+
+def build_keywords(ev: Dict[str, Any], cap: int = 8, max_query_len: int = 400) -> List[str]:
+    # tags first, then title words; single pass that stops as soon as `cap` unique keywords are
+    # found or the OR'd query would pass `max_query_len` (reddit returns nothing for overlong queries)
+    title_words = (w for w in _TOK.findall((ev.get("title") or "").lower()) if w not in _STOPWORDS)
+    keywords: List[str] = []
+    seen = set()
+    total = 0
+    for k in itertools.chain(ev.get("tags") or [], title_words):
+        k = str(k).strip().lower()
+        if not k or k in seen:
+            continue
+        cost = len(k) + 6  # " OR " plus quotes around multi-word keywords
+        if total + cost > max_query_len:
+            break
+        seen.add(k)
+        keywords.append(k)
+        total += cost
+        if len(keywords) == cap:
+            break
+    return keywords
+
+
+def build_query(keywords: List[str]) -> str:
+    # quote multi-word tags so "machine learning" is searched as a phrase, not two OR'd words
+    return " OR ".join(f'"{k}"' if " " in k else k for k in keywords)
+
+
+# LRU of reddit_ids already stored, so re-polled posts/comments skip scoring and the upsert
+_stored_ids: "OrderedDict[str, None]" = OrderedDict()
+_stored_ids_lock = threading.Lock()
+
+
+def recently_stored(reddit_id: Optional[str]) -> bool:
+    with _stored_ids_lock:
+        if reddit_id in _stored_ids:
+            _stored_ids.move_to_end(reddit_id)
+            return True
+        return False
+
+
+def remember_stored(reddit_ids: List[str]) -> None:
+    with _stored_ids_lock:
+        for rid in reddit_ids:
+            _stored_ids[rid] = None
+            _stored_ids.move_to_end(rid)
+        while len(_stored_ids) > SEEN_CACHE_SIZE:
+            _stored_ids.popitem(last=False)
+
+
+def warm_stored_ids(days: int = 1, page_size: int = 1000) -> None:
+    """
+    Seed the stored-id LRU with reddit_ids already in reddit_comments from the last `days`,
+    so a freshly restarted worker skips scoring/writing rows it stored before the restart.
+    """
+    since = to_iso(time.time() - days * 86400)
+    loaded = 0
     try:
-        resp = sb.table("reddit_comments").select("id").eq("event_id", event_id).limit(1).execute()
-        if resp.error:
-            logger.warning("event_already_processed query error for %s: %s", event_id, resp.error)
-            return False
-        return bool(resp.data)
+        while loaded < SEEN_CACHE_SIZE:
+            resp = (
+                sb.table("reddit_comments").select("reddit_id").gt("created_utc", since)
+                .order("created_utc", desc=True).range(loaded, loaded + page_size - 1).execute()
+            )
+            ids = [r["reddit_id"] for r in (resp.data or []) if r.get("reddit_id")]
+            # oldest first, so the newest ids end up most recently used
+            remember_stored(ids[::-1])
+            loaded += len(resp.data or [])
+            if len(resp.data or []) < page_size:
+                break
     except Exception as e:
-        logger.exception("error checking processed status for event %s: %s", event_id, e)
-        return False
+        logger.exception("warm_stored_ids exception: %s", e)
+    logger.info("seeded stored-id cache with %d reddit_id(s) from the last %d day(s)", loaded, days)
 
 
-def insert_comment_row(row: Dict[str, Any]) -> None:
+def fetch_stored_ids(reddit_ids: List[str]) -> Set[str]:
+    """
+    Look up which of `reddit_ids` are already in reddit_comments with one `reddit_id in (...)`
+    query, and add them to the stored-id LRU. Covers what warm_stored_ids misses: rows older
+    than its window, or written by another worker.
+    """
+    ids = [rid for rid in dict.fromkeys(reddit_ids) if rid]
+    if not ids:
+        return set()
     try:
-        resp = sb.table("reddit_comments").insert(row).execute()
-        if resp.error:
-            msg = getattr(resp.error, "message", str(resp.error)).lower()
-            if "unique" in msg or "duplicate" in msg or "already exists" in msg:
-                logger.debug("duplicate reddit_id %s: skipping", row.get("reddit_id"))
-            else:
-                logger.warning("insert error reddit_id=%s: %s", row.get("reddit_id"), resp.error)
+        resp = sb.table("reddit_comments").select("reddit_id").in_("reddit_id", ids).execute()
+    except Exception as e:
+        logger.exception("fetch_stored_ids exception: %s", e)
+        return set()
+    stored = {r["reddit_id"] for r in (resp.data or [])}
+    remember_stored(list(stored))
+    return stored
+
+
+REDDIT_COLUMNS = tuple(f.name for f in fields(RedditRow))
+
+_COLS = ", ".join(REDDIT_COLUMNS)
+
+
+class _IngestConnection(psycopg2.extensions.connection):
+    """Connection that remembers whether its session-level staging table / prepared insert exist."""
+    ingest_ready = False
+
+
+# direct Postgres connections for the bulk write path (one per db writer thread)
+_pg_pool: Optional[ThreadedConnectionPool] = None
+_pg_pool_lock = threading.Lock()
+
+
+def _prepare_ingest(conn: _IngestConnection) -> None:
+    # once per connection: the temp staging table and a server-side prepared statement for the
+    # staging -> reddit_comments move (same anti-join as ingest_reddit_batch), so each chunk is
+    # only a COPY plus an EXECUTE with no SQL to parse/plan
+    with conn, conn.cursor() as cur:
+        cur.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS reddit_comments_stage "
+            "(LIKE public.reddit_comments INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+        )
+        cur.execute(
+            f"PREPARE ingest_stage AS INSERT INTO public.reddit_comments ({_COLS}) "
+            f"SELECT DISTINCT ON (s.reddit_id) {_COLS} FROM reddit_comments_stage s "
+            "WHERE s.reddit_id IS NOT NULL "
+            "AND NOT EXISTS (SELECT 1 FROM public.reddit_comments r WHERE r.reddit_id = s.reddit_id) "
+            "ON CONFLICT (reddit_id) DO NOTHING"
+        )
+    conn.ingest_ready = True
+
+
+def _copy_rows(chunk: List[RedditRow]) -> None:
+    """
+    COPY a chunk into a session-local staging table, then move the not-yet-stored rows into
+    reddit_comments. COPY streams rows instead of having PostgREST parse JSON.
+    """
+    global _pg_pool
+    with _pg_pool_lock:
+        if _pg_pool is None:
+            _pg_pool = ThreadedConnectionPool(1, max(1, DB_WRITERS), DB_URL, connection_factory=_IngestConnection)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for r in chunk:
+        # csv writes None as an unquoted empty field, which COPY reads as NULL
+        writer.writerow([json.dumps(r.payload) if c == "payload" else getattr(r, c) for c in REDDIT_COLUMNS])
+    buf.seek(0)
+
+    conn = _pg_pool.getconn()
+    try:
+        if not conn.ingest_ready:
+            _prepare_ingest(conn)
+        with conn, conn.cursor() as cur:
+            cur.copy_expert(f"COPY reddit_comments_stage ({_COLS}) FROM STDIN WITH (FORMAT csv)", buf)
+            cur.execute("EXECUTE ingest_stage")
+    finally:
+        _pg_pool.putconn(conn, close=conn.closed != 0)
+
+
+# cleared after the first "function not found" so we stop asking for an undeployed RPC
+_rpc_ingest_available = True
+
+
+def _rpc_ingest_rows(chunk: List[Dict[str, Any]]) -> bool:
+    """Write a chunk via the ingest_reddit_batch SQL function (anti-join insert, see worker/schema.sql)."""
+    global _rpc_ingest_available
+    try:
+        resp = sb.rpc("ingest_reddit_batch", {"rows": chunk}).execute()
+        logger.debug("ingest_reddit_batch inserted %s of %d row(s)", resp.data, len(chunk))
+        return True
+    except APIError as e:
+        if e.code == RPC_NOT_FOUND:
+            logger.info("ingest_reddit_batch RPC not deployed - using table upserts")
+            _rpc_ingest_available = False
         else:
-            logger.info("inserted reddit row reddit_id=%s type=%s", row.get("reddit_id"), row.get("type"))
+            logger.warning("ingest_reddit_batch RPC failed (%d rows): %s", len(chunk), e)
+        return False
+    except Exception as e:
+        logger.warning("ingest_reddit_batch RPC failed (%d rows): %s", len(chunk), e)
+        return False
+
+
+def _upsert_rows(chunk: List[Dict[str, Any]]) -> bool:
+    try:
+        # return=minimal: don't have PostgREST echo every inserted row back to us
+        sb.table("reddit_comments").upsert(
+            chunk, on_conflict="reddit_id", ignore_duplicates=True, returning=ReturnMethod.minimal
+        ).execute()
+        return True
+    except APIError as e:
+        logger.warning("batch upsert error (%d rows): %s", len(chunk), e)
+        return False
+    except Exception as e:
+        logger.exception("unexpected batch upsert exception (%d rows): %s", len(chunk), e)
+        return False
+
+
+def _chunks(units: List[List[RedditRow]]) -> Iterator[List[RedditRow]]:
+    # a unit (a post and its comments) is never split across chunks, so it is written in one
+    # statement and either lands whole or not at all
+    chunk: List[RedditRow] = []
+    for unit in units:
+        if chunk and len(chunk) + len(unit) > INSERT_BATCH_SIZE:
+            yield chunk
+            chunk = []
+        chunk.extend(unit)
+    if chunk:
+        yield chunk
+
+
+def store_rows(units: List[List[RedditRow]]) -> bool:
+    """
+    Write collected rows in chunks: COPY over a direct connection when DATABASE_URL is set,
+    otherwise one ingest_reddit_batch RPC call per chunk, falling back to a plain table
+    upsert if that function isn't deployed. Duplicate reddit_ids are skipped either way.
+    Returns False if any chunk couldn't be written.
+    """
+    ok = True
+    for chunk in _chunks(units):
+        stored = False
+        if DB_URL:
+            try:
+                _copy_rows(chunk)
+                stored = True
+            except Exception as e:
+                logger.warning("COPY of %d rows failed, falling back to PostgREST: %s", len(chunk), e)
+        if not stored:
+            # PostgREST takes JSON objects: convert only here, at the request boundary
+            payload = [asdict(r) for r in chunk]
+            if _rpc_ingest_available:
+                stored = _rpc_ingest_rows(payload)
+            if not stored:
+                stored = _upsert_rows(payload)
+        if stored:
+            logger.info("stored %d reddit row(s)", len(chunk))
+            remember_stored([r.reddit_id for r in chunk if r.reddit_id])
+        ok = ok and stored
+    return ok
+
+
+# per-post units (the post row plus its comments) waiting to be written; producers block when
+# writers fall this far behind. A unit counts as done (task_done) only once the flush holding
+# it has finished, so write_queue.join() waits for every queued row to be written. Keeping a
+# post with its comments means a retried job never finds the post stored without them.
+write_queue: "queue.Queue[Optional[List[RedditRow]]]" = queue.Queue(maxsize=100)
+
+# bumped whenever a flush fails to write its rows; main_loop compares it around a batch
+_write_failures = 0
+_write_failures_lock = threading.Lock()
+
+
+def write_failures() -> int:
+    with _write_failures_lock:
+        return _write_failures
+
+
+def _flush(buf: List[List[RedditRow]]) -> bool:
+    # concurrent jobs can surface the same post/comment, and another writer may have stored it
+    # since it was queued: drop those before paying for scoring and the write
+    seen = set()
+    units = []
+    for unit in buf:
+        kept = []
+        for row in unit:
+            rid = row.reddit_id
+            if rid in seen or recently_stored(rid):
+                continue
+            seen.add(rid)
+            kept.append(row)
+        if kept:
+            units.append(kept)
+    # sentiment is computed here, on the writer side, so job threads never wait on VADER
+    if not units:
+        return True
+    score_rows([row for unit in units for row in unit])
+    return store_rows(units)
+
+
+def _flush_and_ack(buf: List[List[RedditRow]]) -> None:
+    # never let an error kill the writer: a dead writer stops draining write_queue and
+    # producers would block on put() forever once it fills
+    global _write_failures
+    try:
+        ok = _flush(buf)
+    except Exception as e:
+        logger.exception("db writer failed to flush %d row(s): %s", sum(map(len, buf)), e)
+        ok = False
+    if not ok:
+        with _write_failures_lock:
+            _write_failures += 1
+    for _ in buf:
+        write_queue.task_done()
+
+
+def _db_writer() -> None:
+    buf: List[List[RedditRow]] = []
+    pending = 0
+    deadline = None
+    while True:
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            unit = write_queue.get(timeout=timeout)
+        except queue.Empty:
+            unit = ...  # flush timer expired
+        if unit is None:  # shutdown sentinel
+            _flush_and_ack(buf)
+            write_queue.task_done()
+            return
+        if unit is not ...:
+            buf.append(unit)
+            pending += len(unit)
+            if deadline is None:
+                deadline = time.monotonic() + WRITE_FLUSH_SECONDS
+        if buf and (pending >= WRITE_FLUSH_ROWS or time.monotonic() >= deadline):
+            _flush_and_ack(buf)
+            buf = []
+            pending = 0
+            deadline = None
+
+
+def start_db_writers() -> List[threading.Thread]:
+    writers = [threading.Thread(target=_db_writer, name=f"db-writer-{i}") for i in range(DB_WRITERS)]
+    for w in writers:
+        w.start()
+    return writers
+
+
+def stop_db_writers(writers: List[threading.Thread]) -> None:
+    for _ in writers:
+        write_queue.put(None)
+    for w in writers:
+        w.join()
+
+
+def _process_post(post: Any, event_id: str) -> List[RedditRow]:
+    # read fields from the already-parsed attribute dict: getattr on a PRAW object falls back
+    # to a lazy network fetch for anything missing, and pays descriptor dispatch on every access
+    d = vars(post)
+    # multi-reddit results carry their own subreddit; recover it per post
+    sub = getattr(d.get("subreddit"), "display_name", None)
+    post_id = d.get("id")
+    created_ts = d.get("created_utc")
+    author = d.get("author")
+    rows: List[RedditRow] = []
+    try:
+        post_row = RedditRow(
+            event_id=event_id,
+            reddit_id=post_id,
+            subreddit=sub,
+            type="post",
+            title=d.get("title"),
+            body=d.get("selftext") or None,
+            author=str(author) if author else None,
+            sentiment=None,  # filled in by the db writer (score_rows)
+            created_utc=to_iso(created_ts),
+            payload={
+                "permalink": d.get("permalink"),
+                "url": d.get("url"),
+                "score": d.get("score"),
+            },
+        )
+        rows.append(post_row)
     except Exception as e:
-        logger.exception("unexpected insert exception for reddit_id=%s: %s", row.get("reddit_id"), e)
+        logger.exception("error handling post in %s: %s", sub, e)
+
+    # comments (best-effort)
+    try:
+        # one GET /comments/<id> with limit + depth=1: Reddit returns the post and only its first
+        # top-level comments, and we read them straight off the listing instead of building a
+        # CommentForest (made through this thread's client, not the one that ran the search)
+        with reddit_call():
+            _, listing = reddit_client().get(
+                f"/comments/{post_id}", params={"limit": MAX_COMMENTS_PER_POST, "depth": 1}
+            )
+        comments = (c for c in listing if not isinstance(c, MoreComments))
+        for c in itertools.islice(comments, MAX_COMMENTS_PER_POST):
+            try:
+                cd = vars(c)
+                c_author = cd.get("author")
+                crow = RedditRow(
+                    event_id=event_id,
+                    reddit_id=cd.get("id"),
+                    subreddit=sub,
+                    type="comment",
+                    title=None,
+                    body=cd.get("body") or None,
+                    author=str(c_author) if c_author else None,
+                    sentiment=None,
+                    created_utc=to_iso(cd.get("created_utc") or created_ts),
+                    payload={"link_id": cd.get("link_id"), "parent_id": cd.get("parent_id")},
+                )
+                rows.append(crow)
+            except Exception as e:
+                logger.exception("error building comment row for post %s: %s", post_id, e)
+    except prawcore.exceptions.TooManyRequests as e:
+        # defer the whole job: storing the post without its comments would mark it as done
+        note_rate_limit(e)
+        raise RateLimited("reddit rate limit hit fetching comments") from e
+    except RateLimited:
+        raise
+    except Exception as e:
+        logger.debug("couldn't fetch comments for post %s: %s", post_id, e)
+    return rows
+
+
+# subreddits that 404'd / are private / redirect (i.e. don't exist), skipped for BAD_SUBREDDIT_TTL
+_MISSING_SUBREDDIT_ERRORS = (
+    prawcore.exceptions.NotFound,
+    prawcore.exceptions.Forbidden,
+    prawcore.exceptions.Redirect,
+)
+BAD_SUBREDDIT_TTL = 24 * 3600
+_bad_subreddits: Dict[str, float] = {}  # lowercased name -> expiry (epoch secs)
+
+
+def subreddit_known_bad(name: str) -> bool:
+    return _bad_subreddits.get(name.lower(), 0.0) > time.time()
+
+
+# recent search results, so events sharing subreddits and keywords (two hackathons, say)
+# don't repeat the same Reddit search within a few minutes of each other
+SEARCH_CACHE_TTL = 300
+_search_cache: Dict[Tuple[str, str], Tuple[float, List[Any]]] = {}  # (multi, query) -> (expiry, posts)
+_search_cache_lock = threading.Lock()
+
+
+def _search_subreddits(subreddits: List[str], query: str) -> List[Any]:
+    # one multi-reddit search (r/a+b+c) instead of one request per subreddit
+    multi = "+".join(subreddits)
+    key = (multi.lower(), query)
+    with _search_cache_lock:
+        hit = _search_cache.get(key)
+    if hit and hit[0] > time.time():
+        return hit[1]
+    with reddit_call():
+        posts = list(reddit_client().subreddit(multi).search(
+            query, sort="new", limit=MAX_POSTS_PER_SUB * len(subreddits)
+        ))
+    now = time.time()
+    with _search_cache_lock:
+        for k in [k for k, (expiry, _) in _search_cache.items() if expiry <= now]:
+            del _search_cache[k]
+        _search_cache[key] = (now + SEARCH_CACHE_TTL, posts)
+    return posts
+
+
+def _search_one_subreddit(sub: str, query: str) -> List[Any]:
+    try:
+        return _search_subreddits([sub], query)
+    except _MISSING_SUBREDDIT_ERRORS as e:
+        logger.warning("subreddit %s unavailable (%s) - skipping it for %ss", sub, e, BAD_SUBREDDIT_TTL)
+        _bad_subreddits[sub.lower()] = time.time() + BAD_SUBREDDIT_TTL
+        return []
+
+
+def _search_each_subreddit(subreddits: List[str], query: str) -> List[Any]:
+    posts: List[Any] = []
+    for sub_posts in reddit_pool.map(lambda sub: _search_one_subreddit(sub, query), subreddits):
+        posts.extend(sub_posts)
+    return posts
 
 
 def search_and_store_for_event(ev: Dict[str, Any]) -> None:
@@ -142,102 +913,123 @@ def search_and_store_for_event(ev: Dict[str, Any]) -> None:
         logger.warning("search_and_store_for_event: empty event id, skipping")
         return
 
-    # guard: if already have reddit rows, skip
-    if event_already_processed(event_id):
-        logger.info("event %s already processed (reddit_comments present) -> skipping", event_id)
-        return
+    if time.time() < rate_limited_until:
+        raise RateLimited("reddit rate limit in effect")
 
-    title_words = (ev.get("title") or "").lower().split()
-    raw_keywords = [k for k in (ev.get("tags") or []) if k] + title_words
-    keywords = list(dict.fromkeys(raw_keywords))[:8] if raw_keywords else title_words[:5]
+    keywords = build_keywords(ev)
     if not keywords:
         logger.info("no keywords for event %s - skipping", event_id)
         return
 
-    query = " OR ".join([str(k) for k in keywords if k])
-    subreddits = build_subreddit_list(ev)
+    query = build_query(keywords)
+    subreddits = [s for s in build_subreddit_list(ev) if not subreddit_known_bad(s)]
+    if not subreddits:
+        logger.info("event %s only maps to unavailable subreddits - skipping", event_id)
+        return
     logger.info("event=%s searching query=%r subs=%s", event_id, query, subreddits)
 
-    for sub in subreddits:
+    multi = "+".join(subreddits)
+    try:
         try:
-            subreddit = reddit.subreddit(sub)
-        except Exception as e:
-            logger.warning("cannot access subreddit %s: %s", sub, e)
+            posts = _search_subreddits(subreddits, query)
+        except _MISSING_SUBREDDIT_ERRORS:
+            # one missing/private name fails the whole multi-reddit: find it and search the rest
+            posts = _search_each_subreddit(subreddits, query)
+    except prawcore.exceptions.TooManyRequests as e:
+        note_rate_limit(e)
+        raise RateLimited("reddit rate limit hit during search") from e
+    except RateLimited:
+        raise
+    except Exception as e:
+        logger.exception("search error for subreddits %s: %s", multi, e)
+        return
+
+    # drop posts already seen for this event or stored in a previous cycle, and search hits that
+    # don't actually mention any keyword (reddit's relevance is loose in broad subs) before they
+    # cost a comment fetch, scoring and a write
+    kwset = set(keywords)
+    seen = set()
+    new_posts = []
+    for post in posts:
+        d = vars(post)
+        post_id = d.get("id")
+        if post_id in seen or recently_stored(post_id):
+            continue
+        text_l = f"{d.get('title') or ''} {d.get('selftext') or ''}".lower()
+        if not any(k in text_l for k in kwset):
             continue
+        seen.add(post_id)
+        new_posts.append(post)
+    # the LRU only knows what this process stored or warmed; ask the table about the rest in one
+    # query so stored posts don't cost a comment fetch (and their comments a write) again
+    if new_posts:
+        stored = fetch_stored_ids([vars(post).get("id") for post in new_posts])
+        new_posts = [post for post in new_posts if vars(post).get("id") not in stored]
 
-        try:
-            for post in subreddit.search(query, sort="new", limit=MAX_POSTS_PER_SUB):
-                try:
-                    post_id = getattr(post, "id", None)
-                    created_ts = getattr(post, "created_utc", None)
-                    created = datetime.fromtimestamp(created_ts, tz=timezone.utc) if created_ts else datetime.now(timezone.utc)
-                    post_row = {
-                        "event_id": event_id,
-                        "reddit_id": post_id,
-                        "subreddit": sub,
-                        "type": "post",
-                        "title": getattr(post, "title", None),
-                        "body": getattr(post, "selftext", None) or None,
-                        "author": str(getattr(post, "author", None)) if getattr(post, "author", None) else None,
-                        "sentiment": float(senti((getattr(post, "title", "") or "") + " " + (getattr(post, "selftext", "") or ""))),
-                        "created_utc": created.isoformat(),
-                        "payload": {
-                            "permalink": getattr(post, "permalink", None),
-                            "url": getattr(post, "url", None),
-                            "score": getattr(post, "score", None),
-                        },
-                    }
-                    insert_comment_row(post_row)
-                except Exception as e:
-                    logger.exception("error handling post in %s: %s", sub, e)
-
-                # comments (best-effort)
-                try:
-                    post.comments.replace_more(limit=0)
-                    for c in post.comments.list()[:MAX_COMMENTS_PER_POST]:
-                        try:
-                            c_id = getattr(c, "id", None)
-                            c_ts = getattr(c, "created_utc", None) or created_ts
-                            crow = {
-                                "event_id": event_id,
-                                "reddit_id": c_id,
-                                "subreddit": sub,
-                                "type": "comment",
-                                "title": None,
-                                "body": getattr(c, "body", None) or None,
-                                "author": str(getattr(c, "author", None)) if getattr(c, "author", None) else None,
-                                "sentiment": float(senti(getattr(c, "body", "") or "")),
-                                "created_utc": datetime.fromtimestamp(c_ts, tz=timezone.utc).isoformat() if c_ts else datetime.now(timezone.utc).isoformat(),
-                                "payload": {"link_id": getattr(c, "link_id", None), "parent_id": getattr(c, "parent_id", None)},
-                            }
-                            insert_comment_row(crow)
-                        except Exception as e:
-                            logger.exception("error inserting comment for post %s: %s", getattr(post, "id", None), e)
-                except Exception as e:
-                    logger.debug("couldn't fetch comments for post %s: %s", getattr(post, "id", None), e)
+    # comment fetches are one request per post, so run them concurrently (bounded by reddit_call)
+    units: List[List[RedditRow]] = []
+    if new_posts:
+        for post_rows in reddit_pool.map(lambda post: _process_post(post, event_id), new_posts):
+            unit = []
+            for row in post_rows:
+                if row.type == "comment":
+                    if row.reddit_id in seen or recently_stored(row.reddit_id):
+                        continue
+                    seen.add(row.reddit_id)
+                unit.append(row)
+            if unit:
+                units.append(unit)
 
-        except Exception as e:
-            logger.exception("search error for subreddit %s: %s", sub, e)
+    # hand off unscored rows to the db writers (they score + store) so this thread can move on;
+    # each post goes with its comments so they are written together
+    for unit in units:
+        write_queue.put(unit)
+
+
+# cleared after the first "function not found" so we stop asking for an undeployed RPC
+_rpc_claim_available = True
 
 
 def claim_jobs(limit: int = JOB_BATCH_SIZE) -> List[Dict[str, Any]]:
     """
-    Claim a small batch of unprocessed jobs. We use a simple
-    'select where processed=false order by created_at limit N' then update attempts.
-    For stronger guarantees you'd use SELECT ... FOR UPDATE SKIP LOCKED but Supabase/PostgREST
-    doesn't expose that directly; this approach is OK for small scale.
+    Claim a small batch of unprocessed jobs with the claim_reddit_jobs RPC: one
+    UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED) RETURNING * that bumps
+    attempts atomically, so concurrent workers never claim the same job.
+    Falls back to select-then-update (racy, N+1 round-trips) if the function isn't deployed.
+    Returned rows carry the bumped attempts either way.
     """
+    global _rpc_claim_available
+    if _rpc_claim_available:
+        try:
+            return sb.rpc("claim_reddit_jobs", {"n": limit, "max_attempts": MAX_ATTEMPTS}).execute().data or []
+        except APIError as e:
+            if e.code != RPC_NOT_FOUND:
+                logger.error("claim_jobs rpc error: %s", e)
+                return []
+            logger.info("claim_reddit_jobs RPC not deployed - claiming with select + update")
+            _rpc_claim_available = False
+        except Exception as e:
+            logger.exception("claim_jobs rpc exception: %s", e)
+            return []
+    return _claim_jobs_fallback(limit)
+
+
+def _claim_jobs_fallback(limit: int) -> List[Dict[str, Any]]:
     try:
         # get unprocessed jobs
-        res = sb.table("reddit_jobs").select("*").eq("processed", False).order("created_at", {"ascending": True}).limit(limit).execute()
-        if res.error:
-            logger.error("claim_jobs select error: %s", res.error)
-            return []
+        # jobs that used up MAX_ATTEMPTS stay unprocessed (with last_error) but must not be re-claimed,
+        # or they would sit at the head of the queue forever
+        res = (
+            sb.table("reddit_jobs").select("*").eq("processed", False)
+            .or_(f"attempts.is.null,attempts.lt.{MAX_ATTEMPTS}")
+            .order("created_at").order("id").limit(limit).execute()
+        )
         rows = res.data or []
         # increment attempts to indicate claim (best-effort)
         for r in rows:
+            r["attempts"] = (r.get("attempts") or 0) + 1
             try:
-                sb.table("reddit_jobs").update({"attempts": (r.get("attempts") or 0) + 1}).eq("id", r["id"]).execute()
+                sb.table("reddit_jobs").update({"attempts": r["attempts"]}).eq("id", r["id"]).execute()
             except Exception:
                 logger.debug("failed to bump attempts for job %s (ignore)", r.get("id"))
         return rows
@@ -246,11 +1038,14 @@ def claim_jobs(limit: int = JOB_BATCH_SIZE) -> List[Dict[str, Any]]:
         return []
 
 
-def mark_job_processed(job_id: str) -> None:
+def mark_jobs_processed(job_ids: List[str]) -> None:
+    # one `id in (...)` update for every job of a batch that finished
+    if not job_ids:
+        return
     try:
-        sb.table("reddit_jobs").update({"processed": True, "processed_at": datetime.now(timezone.utc).isoformat()}).eq("id", job_id).execute()
+        sb.table("reddit_jobs").update({"processed": True, "processed_at": datetime.now(timezone.utc).isoformat()}).in_("id", job_ids).execute()
     except Exception as e:
-        logger.exception("failed to mark job %s processed: %s", job_id, e)
+        logger.exception("failed to mark jobs %s processed: %s", job_ids, e)
 
 
 def mark_job_error(job_id: str, err: str) -> None:
@@ -260,69 +1055,255 @@ def mark_job_error(job_id: str, err: str) -> None:
         logger.exception("failed to update job error for %s: %s", job_id, e)
 
 
-def fetch_event_by_id(event_id: str) -> Optional[Dict[str, Any]]:
+def defer_job(job_id: str, attempts: int, reason: str) -> None:
+    # like mark_job_error, but resets attempts to what they were before the claim
     try:
-        resp = sb.table("event_submissions").select("*").eq("id", event_id).limit(1).execute()
-        if resp.error:
-            logger.error("fetch_event_by_id error: %s", resp.error)
-            return None
-        rows = resp.data or []
-        return rows[0] if rows else None
+        sb.table("reddit_jobs").update(
+            {"last_error": reason, "processed": False, "attempts": max(0, attempts)}
+        ).eq("id", job_id).execute()
     except Exception as e:
-        logger.exception("fetch_event_by_id exception: %s", e)
+        logger.exception("failed to defer job %s: %s", job_id, e)
+
+
+# only the columns the worker reads (skips descriptions, poster urls, ...)
+EVENT_COLUMNS = "id,title,tags,subreddits,created_at,start_time"
+
+
+def fetch_events_by_ids(event_ids: List[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Fetch the events for a whole claimed batch with one `id in (...)` query.
+    Returns None if the query failed, so callers can tell that apart from events that don't exist.
+    """
+    ids = list(dict.fromkeys(e for e in event_ids if e))
+    if not ids:
+        return {}
+    try:
+        resp = sb.table("event_submissions").select(EVENT_COLUMNS).in_("id", ids).execute()
+    except Exception as e:
+        logger.exception("fetch_events_by_ids exception: %s", e)
         return None
+    return {r["id"]: r for r in (resp.data or [])}
+
+
+_listen_conn = None
+_listen_lost = False  # set when the LISTEN connection drops; NOTIFYs sent meanwhile are gone
+
+
+def _listen_connection():
+    global _listen_conn
+    if _listen_conn is None or _listen_conn.closed:
+        # TCP keepalives so a silently dropped connection errors out within a couple of minutes
+        # instead of leaving us waiting for the safety poll
+        conn = psycopg2.connect(DB_URL, keepalives=1, keepalives_idle=60, keepalives_interval=10, keepalives_count=3)
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {JOBS_CHANNEL}")
+        _listen_conn = conn
+        logger.info("listening for new jobs on channel %s", JOBS_CHANNEL)
+    return _listen_conn
+
+
+def wait_for_jobs(timeout: float) -> bool:
+    """
+    Block until a new reddit_jobs row is announced via NOTIFY or `timeout` seconds pass.
+    Returns True if woken by a notification. Without DATABASE_URL this is a plain sleep.
+    """
+    global _listen_conn, _listen_lost
+    if not DB_URL:
+        time.sleep(timeout)
+        return False
+    try:
+        conn = _listen_connection()
+        if _listen_lost:
+            # listening again after a drop: claim once right away to pick up jobs whose
+            # notifications were sent while we weren't connected
+            _listen_lost = False
+            return True
+        if select.select([conn], [], [], timeout) == ([], [], []):
+            return False
+        conn.poll()
+        woke = bool(conn.notifies)
+        conn.notifies.clear()
+        return woke
+    except Exception as e:
+        logger.warning("LISTEN connection failed, falling back to polling: %s", e)
+        try:
+            if _listen_conn is not None:
+                _listen_conn.close()
+        except Exception:
+            pass
+        _listen_conn = None
+        _listen_lost = True
+        time.sleep(min(timeout, POLL_SECONDS))
+        return False
+
+
+def process_job(job: Dict[str, Any], event_row: Optional[Dict[str, Any]]) -> bool:
+    """Run one claimed job. Returns True when it completed and should be marked processed."""
+    job_id = job.get("id")
+    event_id = job.get("event_id")
+    attempts = job.get("attempts", 0) or 0
+    logger.info("processing job=%s event=%s attempts=%s", job_id, event_id, attempts)
+
+    if attempts > MAX_ATTEMPTS:
+        logger.warning("job %s exceeded max attempts (%s) - marking error and skipping", job_id, attempts)
+        mark_job_error(job_id, f"exceeded max attempts {attempts}")
+        return False
+
+    if not event_row:
+        msg = f"event id {event_id} not found"
+        logger.warning(msg)
+        mark_job_error(job_id, msg)
+        return False
+
+    # normalize and process
+    ev = normalize_event_row(event_row)
+    try:
+        search_and_store_for_event(ev)
+        logger.info("job %s completed for event %s", job_id, event_id)
+        return True
+    except RateLimited as e:
+        # leave the job unprocessed; it is picked up again once the back-off expires, and the
+        # attempt the claim spent on it is handed back (a 429 isn't the job's fault)
+        logger.info("job %s deferred: %s", job_id, e)
+        defer_job(job_id, attempts - 1, str(e))
+    except Exception as e:
+        logger.exception("error processing job %s: %s", job_id, e)
+        # record last_error and keep processed=false so it can be retried (or mark attempts > max to stop)
+        mark_job_error(job_id, str(e))
+    return False
+
+
+class Shutdown(BaseException):
+    # a BaseException, so the `except Exception` blocks around I/O don't swallow it
+    pass
+
+
+_stopping = False
+_idle = False  # set while main_loop is only sleeping / waiting for jobs
+
+
+def _on_sigterm(signum, frame):
+    # the dyno gets SIGTERM shortly before it is killed: finish the batch in hand (its rows get
+    # written and its jobs settled), then drain the write queue. Nothing is in flight while
+    # main_loop is idle, so stop waiting right away in that case.
+    global _stopping
+    _stopping = True
+    if _idle:
+        raise Shutdown()
+
+
+@contextlib.contextmanager
+def _interruptible():
+    global _idle
+    _idle = True
+    try:
+        if _stopping:
+            raise Shutdown()
+        yield
+    finally:
+        _idle = False
+
+
+def settle_jobs(job_ids: List[str], writes_failed: bool) -> None:
+    """Mark the finished jobs of a batch processed, unless some of the rows they queued weren't stored."""
+    if not writes_failed:
+        mark_jobs_processed(job_ids)
+        return
+    # leave them unprocessed so they are claimed again. A post is written in the same chunk as its
+    # comments, so one that did get stored already has them and is safe to skip on the retry.
+    for job_id in job_ids:
+        mark_job_error(job_id, "some rows couldn't be stored - will retry")
 
 
 def main_loop():
-    logger.info("reddit worker started (job queue mode), poll interval=%s secs", POLL_SECONDS)
-    while True:
+    signal.signal(signal.SIGTERM, _on_sigterm)
+    logger.info(
+        "reddit worker started (job queue mode), %s",
+        f"LISTEN {JOBS_CHANNEL}, safety poll={SAFETY_POLL_SECONDS} secs" if DB_URL else f"poll interval={POLL_SECONDS} secs",
+    )
+    # fork the sentiment workers now, while this is still the only thread
+    senti_pool.submit(score_text, "").result()
+    warm_stored_ids()
+    writers = start_db_writers()
+    # with LISTEN/NOTIFY new jobs wake us immediately; the deadline is only a catch-up poll. It
+    # advances on a fixed monotonic cadence, so time spent processing doesn't stretch the interval
+    interval = SAFETY_POLL_SECONDS if DB_URL else POLL_SECONDS
+    next_poll = time.monotonic() + interval
+    while not _stopping:
         try:
+            wait = rate_limited_until - time.time()
+            if wait > 0:
+                logger.info("reddit rate limited - waiting %.0f secs before claiming jobs", wait)
+                with _interruptible():
+                    time.sleep(wait)
+                continue
+
             jobs = claim_jobs(JOB_BATCH_SIZE)
             if not jobs:
                 logger.debug("no jobs claimed - sleeping")
             else:
                 logger.info("claimed %d job(s)", len(jobs))
-                for job in jobs:
-                    job_id = job.get("id")
-                    event_id = job.get("event_id")
-                    attempts = job.get("attempts", 0) or 0
-                    logger.info("processing job=%s event=%s attempts=%s", job_id, event_id, attempts)
-
-                    if attempts > MAX_ATTEMPTS:
-                        logger.warning("job %s exceeded max attempts (%s) - marking error and skipping", job_id, attempts)
-                        mark_job_error(job_id, f"exceeded max attempts {attempts}")
+                events_by_id = fetch_events_by_ids([j.get("event_id") for j in jobs])
+                if events_by_id is None:
+                    # transient: record it and let the jobs be claimed again later, rather than
+                    # failing them as "event not found"
+                    for j in jobs:
+                        mark_job_error(j.get("id"), "couldn't fetch event")
+                else:
+                    # an event re-enqueued while its job was pending has several jobs in the queue;
+                    # search it once and settle all of them with the outcome
+                    by_event: Dict[Any, List[Dict[str, Any]]] = {}
+                    for j in jobs:
+                        by_event.setdefault(j.get("event_id"), []).append(j)
+                    # lead with the freshest job, so one that already used up its attempts doesn't
+                    # get the whole event errored while its siblings' attempts are spent for nothing
+                    leads = [min(group, key=lambda j: j.get("attempts") or 0) for group in by_event.values()]
+                    failures = write_failures()
+                    # jobs only block on Reddit/Supabase I/O, so run the batch concurrently
+                    done = list(job_pool.map(lambda j: process_job(j, events_by_id.get(j.get("event_id"))), leads))
+                    # rows are written behind the jobs; wait for all of them before marking any job
+                    # processed, so a failed write or a restart can't lose a finished job's rows
+                    write_queue.join()
+                    settle_jobs(
+                        [j.get("id") for lead, ok in zip(leads, done) if ok for j in by_event[lead.get("event_id")]],
+                        writes_failed=write_failures() != failures,
+                    )
+                    if len(jobs) == JOB_BATCH_SIZE:
+                        # a full batch means more may be queued; their notifications were already
+                        # consumed by the last wakeup, so keep draining instead of waiting
                         continue
 
-                    event_row = fetch_event_by_id(event_id)
-                    if not event_row:
-                        msg = f"event id {event_id} not found"
-                        logger.warning(msg)
-                        mark_job_error(job_id, msg)
-                        continue
+            jitter = random.uniform(0, min(5, interval * 0.1))
+            to_sleep = max(1.0, next_poll - time.monotonic() + jitter)
+            logger.debug("waiting up to %.0f seconds for new jobs (jitter=%s)", to_sleep, jitter)
+            with _interruptible():
+                woke = wait_for_jobs(to_sleep)
+            if woke:
+                logger.debug("woken by new job notification")
+            else:
+                # poll fired: schedule the next one from the previous deadline, not from now
+                # (if we fell a whole interval behind, restart the cadence instead of bursting)
+                next_poll += interval
+                if next_poll <= time.monotonic():
+                    next_poll = time.monotonic() + interval
 
-                    # normalize and process
-                    ev = normalize_event_row(event_row)
-                    try:
-                        search_and_store_for_event(ev)
-                        mark_job_processed(job_id)
-                        logger.info("job %s completed for event %s", job_id, event_id)
-                    except Exception as e:
-                        logger.exception("error processing job %s: %s", job_id, e)
-                        # record last_error and keep processed=false so it can be retried (or mark attempts > max to stop)
-                        mark_job_error(job_id, str(e))
-
-            # small jitter before next poll
-            jitter = random.uniform(0, min(5, POLL_SECONDS * 0.1))
-            to_sleep = max(1, POLL_SECONDS + jitter)
-            logger.debug("sleeping %s seconds (jitter=%s)", to_sleep, jitter)
-            time.sleep(to_sleep)
-
-        except KeyboardInterrupt:
-            logger.info("received KeyboardInterrupt - exiting")
+        except (KeyboardInterrupt, Shutdown) as e:
+            logger.info("received %s - exiting", type(e).__name__)
             break
         except Exception as e:
             logger.exception("main loop unexpected error: %s", e)
-            time.sleep(max(5, POLL_SECONDS // 2))
+            try:
+                with _interruptible():
+                    time.sleep(max(5, POLL_SECONDS // 2))
+            except Shutdown:
+                break
+
+    # let jobs interrupted mid-batch (Ctrl-C) finish queueing, then drain whatever is still
+    # queued or buffered before exiting
+    job_pool.shutdown(wait=True)
+    logger.info("draining %d queued post(s)", write_queue.qsize())
+    stop_db_writers(writers)
 
 
 if __name__ == "__main__":
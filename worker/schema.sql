@@ -0,0 +1,83 @@
+-- worker/schema.sql
+-- Database objects the reddit worker expects on top of the app tables.
+-- Safe to re-run.
+
+-- reddit_jobs: announce new jobs so the worker wakes up without polling (see wait_for_jobs).
+-- Statement-level: the worker only needs a wakeup (it claims whatever is pending), so a bulk
+-- enqueue sends one notification instead of one per row.
+create or replace function public.notify_reddit_job() returns trigger
+language plpgsql as $$
+begin
+  perform pg_notify('reddit_jobs_new', '');
+  return null;
+end;
+$$;
+
+drop trigger if exists reddit_jobs_notify on public.reddit_jobs;
+create trigger reddit_jobs_notify
+  after insert on public.reddit_jobs
+  for each statement execute function public.notify_reddit_job();
+
+-- reddit_comments: batch ingest used by store_rows over PostgREST.
+-- The anti-join drops rows already stored before the insert, so duplicates never reach
+-- the unique index (no failed speculative inserts / dead tuples); DISTINCT ON dedupes
+-- within the batch. ON CONFLICT stays only as a guard against concurrent writers.
+-- Returns the number of rows actually inserted.
+create or replace function public.ingest_reddit_batch(rows jsonb) returns integer
+language sql as $$
+  with staging as (
+    select distinct on (s.reddit_id) s.*
+    from jsonb_populate_recordset(null::public.reddit_comments, rows) s
+    where s.reddit_id is not null
+  ), ins as (
+    insert into public.reddit_comments
+      (event_id, reddit_id, subreddit, type, title, body, author, sentiment, created_utc, payload)
+    select event_id, reddit_id, subreddit, type, title, body, author, sentiment, created_utc, payload
+    from staging s
+    where not exists (select 1 from public.reddit_comments r where r.reddit_id = s.reddit_id)
+    on conflict (reddit_id) do nothing
+    returning 1
+  )
+  select count(*)::integer from ins;
+$$;
+
+drop function if exists public.insert_reddit_comments(jsonb);
+
+-- the anti-join above and ON CONFLICT (reddit_id) (here, in the COPY path and in the upsert
+-- fallback) need a unique, non-partial index on exactly reddit_id; a plain index doesn't count
+do $$
+begin
+  if not exists (
+    select 1 from pg_indexes
+    where schemaname = 'public' and tablename = 'reddit_comments'
+      and indexdef like 'CREATE UNIQUE INDEX % (reddit_id)'
+  ) then
+    create unique index reddit_comments_reddit_id_key on public.reddit_comments (reddit_id);
+  end if;
+end;
+$$;
+
+-- reddit_jobs: atomic batch claim used by claim_jobs (bumps attempts, skips rows another
+-- worker has locked, ignores jobs that already used up their attempts)
+create or replace function public.claim_reddit_jobs(n integer, max_attempts integer)
+returns setof public.reddit_jobs
+language sql as $$
+  update public.reddit_jobs j
+     set attempts = coalesce(j.attempts, 0) + 1
+   where j.id in (
+     select id from public.reddit_jobs
+      where processed = false and coalesce(attempts, 0) < max_attempts
+      order by created_at, id
+      limit n
+      for update skip locked
+   )
+  returning j.*;
+$$;
+
+-- reddit_jobs: the claim scans pending jobs oldest-first. A partial index holds only the
+-- pending rows, so it stays tiny and cached however many processed jobs pile up. It is keyed
+-- (created_at, id) to match the claim's ORDER BY exactly: jobs created in the same instant come
+-- out in a stable order, and the limit is served straight off the index with no sort.
+create index if not exists reddit_jobs_pending_idx
+  on public.reddit_jobs (created_at, id)
+  where processed = false;